@@ -4,6 +4,7 @@
 
 __author__ = 'pts@fazekas.hu (Peter Szabo)'
 
+import time
 import unittest
 
 import intalg
@@ -123,8 +124,45 @@ class IntalgSmokeTest(unittest.TestCase):
 
     #print intalg.brent(100000000000000000039)  # very slow
     #print intalg.brent(1000000000000037)  # very slow
-    #print intalg.factorize(1000000000000037 ** 9)  # slow
-    #print intalg.factorize(1000000000039 ** 9)  # slow
+    self.assertEquals([1000000000000037] * 9,
+                      intalg.factorize(1000000000000037 ** 9))
+    self.assertEquals([1000000000039] * 9, intalg.factorize(1000000000039 ** 9))
+
+  def testSiqs(self):
+    random_obj = intalg.MiniIntRandom(42)
+    p, q = 1000000000000000003, 10000000000000000051
+    self.assertTrue(intalg.siqs(p * q, random_obj) in (p, q))
+    p, q = 30000000000000000041, 100000000000000000039
+    self.assertEquals([p, q], intalg.factorize(p * q, intalg.siqs))
+
+  def testMertens(self):
+    self.assertEquals(1928, intalg.mertens(10 ** 8))
+    self.assertEquals(-222, intalg.mertens(10 ** 9))
+
+  def testTotientSum(self):
+    self.assertEquals(303963551173008414, intalg.totient_sum(10 ** 9))
+
+  def testPrimePowerSum(self):
+    self.assertEquals(455052511, intalg.prime_power_sum(10 ** 10, 0))
+    self.assertEquals(24739512092254535, intalg.prime_power_sum(10 ** 9))
+    self.assertEquals([0, 2880504, 1, 2880950],
+                      intalg.prime_counts_by_residue(10 ** 8, 4))
+
+  def testInvTotientCount(self):
+    t = 20922789888000  # 16!.
+    self.assertEquals(16423633, intalg.inv_totient_count(t))
+    ns = intalg.yield_inv_totient(t)
+    self.assertEquals([20922799053799, 20922799108033, 20922799120681],
+                      [ns.next() for _ in xrange(3)])
+
+  def testFactorizeBudget(self):
+    # Without a budget, this would take several minutes (mostly in siqs).
+    p = 100000000000000000000000000319
+    q = 1000000000000000000000000000057
+    t = time.time()
+    self.assertEquals(([2, 2, 3], [p * q]), intalg.factorize(
+        12 * p * q, budget=intalg.FactorizeBudget(seconds=1)))
+    self.assertTrue(time.time() - t < 10)
 
 
 if __name__ == '__main__':
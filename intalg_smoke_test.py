@@ -6,6 +6,8 @@ __author__ = 'pts@fazekas.hu (Peter Szabo)'
 
 import array
 import math
+import os
+import tempfile
 import unittest
 
 import intalg
@@ -226,6 +228,12 @@ class IntalgSmokeTest(unittest.TestCase):
       b = intalg.pollard(n, random_obj)
       self.assertEquals(b, n)
 
+  def testBrentMaxSteps(self):
+    random_obj = intalg.MiniIntRandom(42)
+    p, q = 1000003, 1000000007
+    self.assertEquals(p * q, intalg.brent(p * q, random_obj, 16))
+    self.assertEquals(p, intalg.brent(p * q, random_obj, 100000))
+
   def testBrentComposite(self):
     random_obj = intalg.MiniIntRandom(42)
     for n in intalg.yield_composites():
@@ -246,6 +254,202 @@ class IntalgSmokeTest(unittest.TestCase):
       assert b <= n
       self.assertEquals(0, n % b, (b, n))
 
+  def testPerfectPower(self):
+    self.assertEquals((0, 1), intalg.perfect_power(0))
+    self.assertEquals((1, 1), intalg.perfect_power(1))
+    self.assertEquals((2, 1), intalg.perfect_power(2))
+    self.assertEquals((2, 6), intalg.perfect_power(64))
+    self.assertEquals((72, 1), intalg.perfect_power(72))
+    self.assertEquals((6, 4), intalg.perfect_power(1296))
+    self.assertEquals((10, 30), intalg.perfect_power(10 ** 30))
+    self.assertEquals((12, 35), intalg.perfect_power(12 ** 35))
+    self.assertEquals((3, 1000), intalg.perfect_power(3 ** 1000))
+    self.assertEquals((3 ** 1000 + 1, 1), intalg.perfect_power(3 ** 1000 + 1))
+    self.assertRaises(ValueError, intalg.perfect_power, -8)
+    for n in xrange(2, 1000):
+      m, k = intalg.perfect_power(n)
+      self.assertEquals(n, m ** k)
+      for j in xrange(k + 1, 11):
+        self.assertFalse(intalg.root_floor(n, j)[1], (n, j))
+
+  def testFactorizePerfectPower(self):
+    p, q = 1000000000000037, 1000000007
+    self.assertEquals([p] * 9, intalg.factorize(p ** 9))
+    self.assertEquals([q] * 6 + [p] * 4, intalg.factorize(p ** 4 * q ** 6))
+    self.assertEquals([q] * 6 + [p] * 3,
+                      intalg.factorize(p ** 3 * q ** 6, intalg.brent))
+
+  def testFactorizeBudget(self):
+    p, q, r = 1000003, 1000000007, 1000000009
+    self.assertEquals(([], [p * q]), intalg.factorize(
+        p * q, budget=intalg.FactorizeBudget(calls=0)))
+    self.assertEquals(([2, 2, 2], [p * q]), intalg.factorize(
+        8 * p * q, budget=intalg.FactorizeBudget(calls=0)))
+    self.assertEquals(([], [p * q, p * q]), intalg.factorize(
+        (p * q) ** 2, budget=intalg.FactorizeBudget(calls=0)))
+    self.assertEquals(([p, q], []), intalg.factorize(
+        p * q, budget=intalg.FactorizeBudget(calls=100)))
+    self.assertEquals(([5, q], []), intalg.factorize(
+        5 * q, budget=intalg.FactorizeBudget(calls=0)))
+    self.assertEquals(([], [p * q]), intalg.factorize(
+        p * q, budget=intalg.FactorizeBudget(seconds=0, timer=lambda: 7)))
+    self.assertEquals(([p, q, r], []), intalg.factorize(
+        p * q * r, budget=intalg.FactorizeBudget(seconds=60)))
+    budget = intalg.FactorizeBudget(calls=1)
+    self.assertEquals(True, budget.consume_call())
+    self.assertEquals(True, budget.is_exhausted())
+    self.assertEquals(False, budget.consume_call())
+    ps = [p]
+    composites = [p * q * r, q * r, p * p]
+    intalg._propagate_to_composites(ps, [p], composites)
+    self.assertEquals([p, p, p, p], ps)
+    self.assertEquals([q * r, q * r], composites)
+
+  def testFactorizeBudgetBrent(self):
+    p, q = 1000000000000000000000007, 10000000000000000000000013
+    for divisor_finder in (intalg.brent, intalg.pollard):
+      ticks = [0]
+
+      def timer():
+        ticks[0] += 1
+        return ticks[0]
+
+      # Without the budget, this would take years.
+      budget = intalg.FactorizeBudget(seconds=20, timer=timer)
+      self.assertEquals(([], [p * q]), intalg.factorize(
+          p * q, divisor_finder, budget=budget))
+      self.assertEquals(True, budget.interrupted)
+      p2, q2 = 1000003, 1000000007
+      self.assertEquals(([p2, q2], []), intalg.factorize(
+          p2 * q2, divisor_finder, budget=intalg.FactorizeBudget(seconds=60)))
+
+  def testAdaptiveDivisorFinderBudget(self):
+    p, q = 1000000000000000000000007, 10000000000000000000000013
+    n = p * q
+    f = intalg.AdaptiveDivisorFinder()
+    r = intalg.MiniIntRandom(n)
+    # Attempts which have used up the calls limit are complete, so they
+    # are counted.
+    budget = intalg.FactorizeBudget(calls=0)
+    for _ in xrange(3):
+      self.assertEquals(n, f(n, r, budget))
+    self.assertEquals(False, budget.interrupted)
+    self.assertEquals({n: 3}, budget.attempts)
+    self.assertEquals({}, f._attempts)  # Kept in the budget instead.
+    # A siqs(...) attempt interrupted at the deadline is not counted.
+    budget = intalg.FactorizeBudget(seconds=0, timer=lambda: 7)
+    budget.attempts[n] = 12  # Skip to siqs(...).
+    self.assertEquals(n, f(n, r, budget))
+    self.assertEquals(True, budget.interrupted)
+    self.assertEquals({n: 12}, budget.attempts)
+    # Given-up composites don't leave state in the finder.
+    for n in (p * q, p * 1000000000000000000000000000057):
+      self.assertEquals(([], [n]), intalg.factorize(
+          n, f, budget=intalg.FactorizeBudget(calls=2)))
+    self.assertEquals({}, f._attempts)
+    # A shared budget continues with the next attempt.
+    budget = intalg.FactorizeBudget(calls=1)
+    intalg.factorize(p * q, f, budget=budget)
+    budget.calls = 1
+    intalg.factorize(p * q, f, budget=budget)
+    self.assertEquals({p * q: 2}, budget.attempts)
+
+  def testSqrtModPrime(self):
+    for p in intalg.primes_upto(200):
+      squares = set()
+      for a in xrange(p):
+        squares.add(a * a % p)
+      for a in xrange(p):
+        if a in squares:
+          r = intalg.sqrt_mod_prime(a, p)
+          assert 0 <= r < p and r * r % p == a, (a, p, r)
+        else:
+          self.assertRaises(ValueError, intalg.sqrt_mod_prime, a, p)
+    p = 2 ** 127 - 1
+    self.assertEquals(12345 ** 2, intalg.sqrt_mod_prime(12345 ** 2, p) ** 2 % p)
+
+  def testSiqs(self):
+    random_obj = intalg.MiniIntRandom(42)
+    p, q = 1000000000039, 10000000000037
+    self.assertTrue(intalg.siqs(p * q, random_obj) in (p, q))
+    self.assertEquals(2, intalg.siqs(2 * p, random_obj))
+    self.assertEquals(p, intalg.siqs(p * p, random_obj))
+    self.assertEquals(7, intalg.siqs(7 * 11, random_obj))  # Uses brent.
+    self.assertEquals([7, p, q], intalg.factorize(7 * p * q, intalg.siqs))
+
+  def testSqufof(self):
+    for n in xrange(3, 2000, 2):
+      d = intalg.squfof(n)
+      if intalg.is_prime(n):
+        self.assertEquals(n, d)
+      else:
+        assert 1 < d < n and n % d == 0, (n, d)
+    p, q = 1000003, 1000000007
+    self.assertTrue(intalg.squfof(p * q) in (p, q))
+
+  def testPollardPm1(self):
+    random_obj = intalg.MiniIntRandom(42)
+    for n in intalg.yield_composites():
+      if n > 300:
+        break
+      d = intalg.pollard_pm1(n, random_obj, 20)
+      assert 1 < d <= n and n % d == 0, (n, d)
+    p = 2 * 3 * 5 * 7 * 11 * 13 * 17 * 19 * 23 * 29 * 31 * 37 * 1009 * 2 + 1
+    q = 1000000000000000000000000000057  # q - 1 is not smooth.
+    self.assertEquals(p, intalg.pollard_pm1(p * q, random_obj, 1009))
+    self.assertEquals(p * q, intalg.pollard_pm1(p * q, random_obj, 100, 1000))
+    # Stage 2 finds 1009 with b1=100.
+    self.assertEquals(p, intalg.pollard_pm1(p * q, random_obj, 100))
+
+  def testEcm(self):
+    random_obj = intalg.MiniIntRandom(42)
+    for n in intalg.yield_composites():
+      if n > 300:
+        break
+      d = intalg.ecm(n, random_obj, 20)
+      assert 1 < d <= n and n % d == 0, (n, d)
+    p, q = 10000000019, 1000000000000000000000000000057
+    d = intalg.ecm(p * q, random_obj, 500)
+    while d == p * q:
+      d = intalg.ecm(p * q, random_obj, 500)
+    self.assertEquals(p, d)
+
+  def testEcmPrimeFlagsSegment(self):
+    primes = intalg.primes_upto(100)
+    for start, end in ((0, 100), (1, 3), (2, 3), (4, 5), (9000, 10000)):
+      flags = intalg._ecm_prime_flags_segment(start, end, primes)
+      self.assertEquals(end - start, len(flags))
+      self.assertEquals(
+          [i for i in xrange(start, end) if i > 1 and intalg.is_prime(i)],
+          [start + i for i in xrange(len(flags)) if flags[i]])
+
+  def testAdaptiveDivisorFinder(self):
+    random_obj = intalg.MiniIntRandom(42)
+    finder = intalg.AdaptiveDivisorFinder(rho_max_bits=40, pm1_b1=100)
+    self.assertEquals(100, finder.pm1_b1)
+    self.assertEquals(10000, intalg.AdaptiveDivisorFinder.pm1_b1)
+    self.assertRaises(TypeError, intalg.AdaptiveDivisorFinder, foo=1)
+    p, q = 1000003, 1000000007
+    finder = intalg.AdaptiveDivisorFinder(
+        rho_max_bits=40, rho_max_steps=4, pm1_b1=100)
+    self.assertEquals(p * q, finder(p * q, random_obj))  # Too few steps.
+    self.assertEquals({p * q: 1}, finder._attempts)
+    self.assertEquals(p * q, finder(p * q, random_obj))  # p - 1 is not smooth.
+    self.assertEquals({p * q: 2}, finder._attempts)
+    self.assertTrue(finder(p * q, random_obj) in (p, q))  # ECM.
+    self.assertEquals({}, finder._attempts)
+    for n in (25, 9, 21):  # brent(...) fails for these with this seed.
+      d = finder(n, random_obj)
+      while d == n:
+        d = finder(n, random_obj)
+      assert 1 < d < n and n % d == 0, (n, d)
+    p, q = 1000003, 1000000000000000000000000000057
+    self.assertEquals([p, q], intalg.factorize(p * q, finder))
+    self.assertEquals({}, finder._attempts)
+    finder._attempts[42] = 1
+    finder.reset()
+    self.assertEquals({}, finder._attempts)
+
   def testTotient(self):
     expected = [0, 1, 1, 2, 2, 4, 2, 6, 4, 6, 4, 10, 4, 12, 6, 8, 8, 16, 6,
                 18, 8, 12, 10, 22]
@@ -269,6 +473,55 @@ class IntalgSmokeTest(unittest.TestCase):
     self.assertEquals(expected2, intalg.totients_upto(limit))
     self.assertEquals(expected2, intalg.totients_upto(limit, force_recursive=1))
     self.assertEquals(expected2, intalg._totients_upto_iterative(limit))
+    for limit in (15, 35, 80):
+      self.assertEquals(expected2[:limit + 1],
+                        intalg._totients_upto_iterative(limit))
+
+  def testMultiplicativeUpto(self):
+    sigmas = intalg.multiplicative_upto(
+        200, lambda p, k: (p ** (k + 1) - 1) / (p - 1))
+    self.assertEquals([0] + [intalg.divisor_sum(n) for n in xrange(1, 201)],
+                      sigmas)
+    result = array.array('b', (9,)) * 201
+    self.assertTrue(result is intalg.multiplicative_upto(
+        200, lambda p, k: -(k == 1), result))
+    self.assertEquals(
+        [0] + [intalg.Factorization(n).mobius() for n in xrange(1, 201)],
+        list(result))
+    calls = []
+    intalg.multiplicative_upto(10, lambda p, k: calls.append((p, k)) or 1)
+    self.assertEquals([(2, 1), (2, 2), (2, 3), (3, 1), (3, 2), (5, 1),
+                       (7, 1)], calls)
+    self.assertEquals([0], intalg.multiplicative_upto(0, None))
+    self.assertEquals([0, 1], intalg.multiplicative_upto(1, None))
+    self.assertRaises(ValueError, intalg.multiplicative_upto, 5, None, [0])
+
+  def testYieldTotientsBetween(self):
+    phis = intalg.totients_upto(500)
+    expected = [(i, phis[i]) for i in xrange(1, 501)]
+    self.assertEquals(expected, list(intalg.yield_totients_between(1, 501)))
+    self.assertEquals(expected[9:],
+                      list(intalg.yield_totients_between(10, 501, 13)))
+    self.assertEquals([], list(intalg.yield_totients_between(7, 7)))
+    lo = 10 ** 12 - 100
+    self.assertEquals([(i, intalg.totient(i)) for i in xrange(lo, lo + 200)],
+                      list(intalg.yield_totients_between(lo, lo + 200)))
+    self.assertRaises(ValueError, list, intalg.yield_totients_between(0, 5))
+    self.assertRaises(ValueError, list,
+                      intalg.yield_totients_between(1, 5, 0))
+
+  def testYieldFactorizeBetween(self):
+    expected = [(i, intalg.factorize(i)) for i in xrange(1, 500)]
+    self.assertEquals(expected, list(intalg.yield_factorize_between(1, 500)))
+    self.assertEquals(expected,
+                      list(intalg.yield_factorize_between(1, 500, 7)))
+    self.assertEquals(expected[99 : 200],
+                      list(intalg.yield_factorize_between(100, 201, 16)))
+    self.assertEquals([], list(intalg.yield_factorize_between(5, 5)))
+    lo = 10 ** 12 - 100
+    self.assertEquals([(i, intalg.factorize(i)) for i in xrange(lo, lo + 200)],
+                      list(intalg.yield_factorize_between(lo, lo + 200)))
+    self.assertRaises(ValueError, list, intalg.yield_factorize_between(0, 5))
 
   def testDivisorCountsUpto(self):
     expected = [0, 1, 2, 2, 3, 2, 4, 2, 4, 3, 4, 2, 6, 2, 4, 4, 5, 2, 6, 2, 6, 4, 4,
@@ -284,10 +537,274 @@ class IntalgSmokeTest(unittest.TestCase):
     self.assertTrue(a is intalg.divisor_counts_upto(100, a))
     self.assertEquals(array.array('I', expected), a)
 
+  def testMobiusUpto(self):
+    self.assertEquals(array.array('b', [0]), intalg.mobius_upto(0))
+    self.assertEquals(
+        array.array('b', [0, 1, -1, -1, 0, -1, 1, -1, 0, 0, 1, -1, 0]),
+        intalg.mobius_upto(12))
+    self.assertEquals(
+        [0] + [intalg.Factorization(n).mobius() for n in xrange(1, 501)],
+        list(intalg.mobius_upto(500)))
+
+  def testMertens(self):
+    mu = intalg.mobius_upto(2000)
+    m = 0
+    for n in xrange(2001):
+      m += mu[n]
+      self.assertEquals(m, intalg.mertens(n))
+    self.assertEquals(212, intalg.mertens(10 ** 6))
+    self.assertRaises(ValueError, intalg.mertens, -1)
+
+  def testTotientSum(self):
+    phis = intalg.totients_upto(600)
+    t = 0
+    for n in xrange(601):
+      t += phis[n]
+      self.assertEquals(t, intalg.totient_sum(n))
+    self.assertEquals(303963552392, intalg.totient_sum(10 ** 6))
+    self.assertRaises(ValueError, intalg.totient_sum, -1)
+
+  def testDivisorSumsUpto(self):
+    self.assertEquals(intalg.divisor_counts_upto(300),
+                      list(intalg.divisor_sums_upto(300, 0)))
+    for k in (1, 2, 3):
+      self.assertEquals(
+          [0] + [intalg.Factorization(n).divisor_sum(k)
+                 for n in xrange(1, 301)],
+          list(intalg.divisor_sums_upto(300, k)))
+    self.assertTrue(isinstance(intalg.divisor_sums_upto(300), array.array))
+    self.assertEquals([0], list(intalg.divisor_sums_upto(0)))
+    # tau(83160) == 128 doesn't fit to a signed char.
+    taus = intalg.divisor_sums_upto(83160, 0)
+    self.assertEquals(128, taus[83160])
+    self.assertEquals(intalg.divisor_counts_upto(83160), list(taus))
+
+  def testDivisorCountSum(self):
+    taus = intalg.divisor_counts_upto(300)
+    for n in xrange(301):
+      self.assertEquals(sum(taus[:n + 1]), intalg.divisor_count_sum(n))
+    self.assertEquals(27785452449086, intalg.divisor_count_sum(10 ** 12))
+
+  def testDivisorSumSum(self):
+    for k in (0, 1, 2, 5):
+      sigmas = intalg.divisor_sums_upto(200, k)
+      t = 0
+      for n in xrange(201):
+        t += sigmas[n]
+        self.assertEquals(t, intalg.divisor_sum_sum(n, k))
+    self.assertEquals(822467034112360628,
+                      intalg.divisor_sum_sum(10 ** 9))
+    self.assertRaises(ValueError, intalg.divisor_sum_sum, 5, -1)
+
+  def testPrimePowerSum(self):
+    primes = intalg.primes_upto(1000)
+    for n in xrange(0, 1001, 7):
+      ps = [p for p in primes if p <= n]
+      for k in (0, 1, 3):
+        self.assertEquals(sum([p ** k for p in ps]),
+                          intalg.prime_power_sum(n, k))
+    self.assertEquals(78498, intalg.prime_power_sum(10 ** 6, 0))
+    self.assertEquals(37550402023, intalg.prime_power_sum(10 ** 6))
+    self.assertRaises(ValueError, intalg.prime_power_sum, 10, -1)
+
+  def testPrimeCountsByResidue(self):
+    primes = intalg.primes_upto(1000)
+    for n in xrange(0, 1001, 37):
+      for m in (1, 2, 3, 4, 10, 12):
+        counts = [0] * m
+        for p in primes:
+          if p <= n:
+            counts[p % m] += 1
+        self.assertEquals(counts, intalg.prime_counts_by_residue(n, m))
+    self.assertEquals([0, 39175, 1, 39322],
+                      intalg.prime_counts_by_residue(10 ** 6, 4))
+
+  def testNdarrayUpto(self):
+    # Uses numpy if available, otherwise the array.array fallback.
+    for limit in (0, 1, 2, 3, 4, 5, 48, 49, 50, 300):
+      self.assertEquals(intalg.totients_upto(limit),
+                        list(intalg.totients_upto_ndarray(limit)))
+      self.assertEquals(intalg.multiplicative_upto(limit, lambda p, k: k + 1),
+                        list(intalg.divisor_counts_upto_ndarray(limit)))
+      self.assertEquals(
+          intalg.multiplicative_upto(limit, lambda p, k: -(k == 1)),
+          list(intalg.mobius_upto_ndarray(limit)))
+    self.assertRaises(ValueError, intalg.totients_upto_ndarray, -1)
+
+  def testDirichletConvolve(self):
+    limit = 500
+    mu = intalg.mobius_upto(limit)
+    one = array.array('b', [0] + [1] * limit)
+    ids = range(limit + 1)
+    for multiplicative in (False, True):
+      self.assertEquals(intalg.totients_upto(limit), intalg.dirichlet_convolve(
+          mu, ids, multiplicative=multiplicative))
+      self.assertEquals(
+          list(intalg.divisor_counts_upto(limit)),
+          intalg.dirichlet_convolve(one, one, multiplicative=multiplicative))
+      self.assertEquals(
+          list(intalg.divisor_sums_upto(limit)),
+          intalg.dirichlet_convolve(ids, one, multiplicative=multiplicative))
+      self.assertEquals(intalg.totients_upto(limit), intalg.mobius_invert(
+          ids, multiplicative=multiplicative))
+      self.assertEquals([0, 1] + [0] * (limit - 1), intalg.mobius_invert(
+          one, multiplicative=multiplicative))
+    self.assertEquals([0, 1, 4, 6, 12, 10, 24],
+                      intalg.dirichlet_convolve(ids, ids, 6))
+    self.assertEquals([0, 1, 1, 1, 1], intalg.mobius_invert(
+        intalg.divisor_counts_upto(4)))
+    self.assertEquals([0], intalg.dirichlet_convolve([5], [7]))
+    self.assertRaises(ValueError, intalg.dirichlet_convolve, ids, ids, 501)
+    self.assertRaises(ValueError, intalg.mobius_invert, [])
+
+  def testLinearSieveUpto(self):
+    r = intalg.linear_sieve_upto(300, intalg.LINEAR_SIEVE_NAMES)
+    self.assertEquals(sorted(intalg.LINEAR_SIEVE_NAMES), sorted(r))
+    for name in intalg.LINEAR_SIEVE_NAMES:
+      self.assertTrue(isinstance(r[name], array.array))
+      self.assertEquals(301, len(r[name]))
+      self.assertEquals(0, r[name][0])
+    self.assertEquals([0, 1, 2, 3, 2, 5, 2, 7, 2, 3], list(r['spf'][:10]))
+    self.assertEquals(intalg.totients_upto(300), list(r['phi']))
+    self.assertEquals(intalg.divisor_counts_upto(300), list(r['tau']))
+    for n in xrange(1, 301):
+      f = intalg.Factorization(n)
+      self.assertEquals(f.mobius(), r['mu'][n])
+      self.assertEquals(f.divisor_sum(), r['sigma'][n])
+      self.assertEquals(len(f), r['omega'][n])
+      self.assertEquals(len(f.primes()), r['Omega'][n])
+    self.assertEquals(['mu'], intalg.linear_sieve_upto(10, ['mu']).keys())
+    self.assertEquals({'spf': array.array('b', [0, 1])},
+                      intalg.linear_sieve_upto(1))
+    self.assertRaises(ValueError, intalg.linear_sieve_upto, 10, ['foo'])
+
+  def testArithTables(self):
+    t = intalg.ArithTables()
+    t.MIN_LIMIT = 16
+    r = intalg.linear_sieve_upto(300, t.NAMES)
+    for limit in (0, 5, 20, 17, 100, 300):
+      for name in t.NAMES:
+        self.assertEquals(list(r[name][:limit + 1]), list(t.get(name, limit)))
+    self.assertEquals(300, t.limit('phi'))
+    v = t.get('sigma', 10)
+    self.assertEquals(11, len(v))
+    self.assertEquals(18, v[-1])
+    self.assertEquals([1, 3, 4], list(v[1:4]))
+    self.assertRaises(IndexError, v.__getitem__, 11)
+    def set_item():
+      v[1] = 5
+    self.assertRaises(TypeError, set_item)
+    t.clear()
+    self.assertEquals(-1, t.limit('phi'))
+    self.assertRaises(ValueError, t.get, 'omega', 10)
+    self.assertEquals(6, intalg.arith_tables.get('tau', 12)[12])
+
   def testDivisors(self):
     self.assertEquals([1], intalg.divisors(1))
     self.assertEquals([1, 2, 3, 4, 6, 12], intalg.divisors(12))
 
+  def testYieldDivisorsSorted(self):
+    for n in xrange(1, 500):
+      self.assertEquals(intalg.divisors(n),
+                        list(intalg.yield_divisors_sorted(n)))
+    f = intalg.Factorization(265252859812191058636308480000000)  # 30!.
+    ds = intalg.yield_divisors_sorted(f)
+    self.assertEquals(range(1, 31), [ds.next() for _ in xrange(30)])
+    self.assertEquals(32, ds.next())
+    self.assertEquals([1, 2, 4, 8], list(intalg.yield_divisors_sorted(
+        [(2, 3)])))
+
+  def testDivisorsUpto(self):
+    limit = 300
+    offsets, flat = intalg.divisors_upto(limit)
+    self.assertEquals(limit + 2, len(offsets))
+    self.assertEquals([0, 0, 1, 3], list(offsets[:4]))
+    for n in xrange(1, limit + 1):
+      self.assertEquals(intalg.divisors(n),
+                        list(flat[offsets[n] : offsets[n + 1]]))
+    sqrts = [intalg.sqrt_floor(n) for n in xrange(limit + 1)]
+    for bs, bounds in ((sqrts, sqrts), (10, [10] * (limit + 1))):
+      offsets, flat = intalg.divisors_upto(limit, bs)
+      for n in xrange(1, limit + 1):
+        self.assertEquals([d for d in intalg.divisors(n) if d <= bounds[n]],
+                          list(flat[offsets[n] : offsets[n + 1]]))
+    self.assertEquals((array.array('b', [0, 0]), array.array('b')),
+                      intalg.divisors_upto(0))
+    self.assertRaises(ValueError, intalg.divisors_upto, 10, [1, 2])
+
+  def testDivisorsUptoFile(self):
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+      offsets, flat = intalg.divisors_upto(100, filename=filename)
+      self.assertEquals([1, 2, 3, 6], list(flat[offsets[6] : offsets[7]]))
+      self.assertEquals(100, flat[-1])
+      flat.close()
+      a = array.array(flat.typecode)
+      f = open(filename, 'rb')
+      try:
+        a.fromfile(f, offsets[-1])
+      finally:
+        f.close()
+      self.assertEquals(1, a[offsets[97]])
+      self.assertEquals(97, a[offsets[97] + 1])
+    finally:
+      os.remove(filename)
+
+  def testDivisorsInRange(self):
+    for n in xrange(1, 500):
+      ds = intalg.divisors(n)
+      for lo, hi in ((0, n + 1), (2, n), (3, 20), (5, 5)):
+        self.assertEquals([d for d in ds if lo <= d < hi],
+                          intalg.divisors_in_range(n, lo, hi))
+    f = intalg.Factorization(265252859812191058636308480000000)  # 30!.
+    ds = intalg.divisors_in_range(f, 16286248000000000, 16286250000000000)
+    self.assertEquals([16286248192500000], ds)
+
+  def testFactorization(self):
+    f = intalg.Factorization(720)
+    self.assertEquals(((2, 4), (3, 2), (5, 1)), f.pairs)
+    self.assertEquals(f, intalg.Factorization([2, 2, 2, 2, 3, 3, 5]))
+    self.assertEquals(f, intalg.Factorization(pairs=[(2, 4), (3, 2), (5, 1)]))
+    self.assertEquals(f, intalg.Factorization(f))
+    self.assertEquals(720, f.value())
+    self.assertEquals(720, int(f))
+    self.assertEquals([2, 2, 2, 2, 3, 3, 5], intalg.factorize(f))
+    self.assertEquals(([2, 2, 2, 2, 3, 3, 5], []), intalg.factorize(
+        f, budget=intalg.FactorizeBudget(calls=0)))
+    self.assertEquals(192, f.totient())
+    self.assertEquals(192, intalg.totient(f))
+    self.assertEquals(30, f.divisor_count())
+    self.assertEquals(30, intalg.divisor_count(f))
+    self.assertEquals(2418, f.divisor_sum())
+    self.assertEquals(2418, intalg.divisor_sum(f))
+    self.assertEquals(30, f.divisor_sum(0))
+    self.assertEquals(sum([d * d for d in intalg.divisors(720)]),
+                      f.divisor_sum(2))
+    self.assertEquals(intalg.divisors(720), f.divisors())
+    self.assertEquals(intalg.divisors(720), intalg.divisors(f))
+    self.assertEquals(intalg.divisors(720),
+                      sorted(intalg.yield_divisors_unsorted(f)))
+    self.assertEquals(0, f.mobius())
+    self.assertEquals(30, f.radical())
+    self.assertEquals(12, f.carmichael())
+    self.assertEquals(-1, intalg.Factorization(30).mobius())
+    self.assertEquals(1, intalg.Factorization(1).mobius())
+    self.assertEquals(1, intalg.Factorization(1).value())
+    self.assertEquals([1], intalg.Factorization(1).divisors())
+    self.assertEquals([1, 1, 2, 2, 4, 2, 2, 4, 80, 6], [
+        intalg.Factorization(n).carmichael()
+        for n in (1, 2, 4, 8, 16, 24, 3, 15, 561, 63)])
+    self.assertEquals(intalg.inv_totient(72),
+                      intalg.inv_totient(intalg.Factorization(72)))
+    g = intalg.Factorization(3 * 7 * 7)
+    self.assertEquals(intalg.Factorization(720 * 147), f * g)
+    self.assertEquals(f, f * g / g)
+    self.assertEquals(intalg.Factorization(240), f / intalg.Factorization(3))
+    self.assertRaises(ValueError, lambda: f / g)
+    self.assertRaises(ValueError, intalg.Factorization, 0)
+    self.assertRaises(TypeError, intalg.Factorization, 'x')
+
   def testInvTotient(self):
     self.assertEquals([1], intalg.inv_totient(1))
     self.assertEquals([3, 4, 6], intalg.inv_totient(2))
@@ -297,6 +814,22 @@ class IntalgSmokeTest(unittest.TestCase):
         [73, 91, 95, 111, 117, 135, 146, 148, 152, 182, 190,
          216, 222, 228, 234, 252, 270], intalg.inv_totient(72))
 
+  def testInvTotientCount(self):
+    for t in xrange(1, 400):
+      ns = intalg.inv_totient(t)
+      self.assertEquals(len(ns), intalg.inv_totient_count(t))
+      self.assertEquals(ns, list(intalg.yield_inv_totient(t)))
+    t = 479001600  # 12!.
+    f = intalg.Factorization(t)
+    self.assertEquals(52844, intalg.inv_totient_count(f))
+    self.assertEquals(52844, intalg.inv_totient_count(
+        t, intalg.divisors(f)))
+    ns = intalg.yield_inv_totient(t)
+    self.assertEquals([479045521, 479046251, 479048707],
+                      [ns.next() for _ in xrange(3)])
+    self.assertEquals(0, intalg.inv_totient_count(14))
+    self.assertEquals([], list(intalg.yield_inv_totient(14)))
+
   def testPrimeIndex(self):
     self.assertEquals(2, intalg.prime_index(5))
     self.assertEquals([256], intalg._prime_cache_limit_ary[:])
@@ -459,6 +992,60 @@ class IntalgSmokeTest(unittest.TestCase):
         [11, 13, 24, 37, 61, 98, 159, 257, 416, 673, 89, 762, 851, 613, 464,
          77, 541, 618, 159, 777], a11)
 
+  def testPisano(self):
+    self.assertEquals(
+        [1, 3, 8, 6, 20, 24, 16, 12, 24, 60, 10, 24, 28, 48, 40, 24, 36, 24,
+         18, 60], [intalg.pisano(m) for m in xrange(1, 21)])
+    for m in xrange(1, 300):
+      f = intalg.yield_fib_mod(m)
+      a, b = f.next(), f.next()
+      k = 0
+      while not k or (a, b) != (0, 1 % m):
+        a, b = b, f.next()
+        k += 1
+      self.assertEquals(k, intalg.pisano(m))
+    self.assertEquals(1500000000000, intalg.pisano(10 ** 12))
+    self.assertEquals(1500, intalg.pisano(intalg.Factorization(1000)))
+    self.assertEquals(2000000016, intalg.pisano(10 ** 9 + 7))
+    self.assertRaises(ValueError, intalg.pisano, 0)
+    # fib_pair_mod would exceed the recursion limit for such a large n.
+    self.assertEquals(552179166, intalg.fib_mod(10 ** 1000, 10 ** 9 + 7))
+    self.assertEquals(intalg.fib_pair_mod(10 ** 100, 1234567)[0],
+                      intalg.fib_mod(10 ** 100, 1234567))
+
+  def testLinearRecurrenceNth(self):
+    f = intalg.linear_recurrence_nth
+    m = 10 ** 9 + 7
+    self.assertEquals([intalg.fib_mod(n, m) for n in xrange(50)],
+                      [f([1, 1], [0, 1], n, m) for n in xrange(50)])
+    self.assertEquals(intalg.fib_mod(10 ** 18, m),
+                      f((1, 1), (0, 1), 10 ** 18, m))
+    self.assertEquals(pow(3, 10 ** 18, m) * 5 % m, f([3], [5], 10 ** 18, m))
+    # Tribonacci numbers, with negative coefficients mod m.
+    a = [0, 0, 1]
+    while len(a) < 60:
+      a.append(a[-1] + a[-2] + a[-3])
+    self.assertEquals([x % 1000 for x in a],
+                      [f([1, 1, 1], [0, 0, 1], n, 1000) for n in xrange(60)])
+    self.assertEquals([x % 97 for x in a],
+                      [f([-96, 1, 98], [0, 0, 1], n, 97) for n in xrange(60)])
+    coeffs = range(1, 41)
+    init = range(40, 0, -1)
+    a = list(init)
+    while len(a) < 200:
+      a.append(sum(c * a[-1 - i] for i, c in enumerate(coeffs)))
+    ns = [0, 39, 40, 41, 199, 100, 128]
+    self.assertEquals([a[n] % m for n in ns],
+                      intalg.linear_recurrence_nths(coeffs, init, ns, m))
+    self.assertEquals([a[n] % m for n in ns],
+                      [f(coeffs, init, n, m) for n in ns])
+    self.assertEquals(0, f([1, 1], [0, 1], 10, 1))
+    self.assertEquals([], intalg.linear_recurrence_nths([1], [1], [], 5))
+    self.assertRaises(ValueError, f, [1, 1], [0], 10, 5)
+    self.assertRaises(ValueError, f, [], [], 10, 5)
+    self.assertRaises(ValueError, f, [1], [1], -1, 5)
+    self.assertRaises(ValueError, f, [1], [1], 1, 0)
+
   def testModinv(self):
     self.assertEquals(intalg.modinv(2 ** 8, 7 ** 8), 4301082)
     self.assertEquals(intalg.modinv(7 ** 8, 2 ** 8), 65)
@@ -499,6 +1086,16 @@ class IntalgSmokeTest(unittest.TestCase):
   def testYieldFactorizeUpto(self):
     self.assertEquals(sorted(list(intalg.yield_factorize_upto(100))),
                       [(i, intalg.factorize(i)) for i in xrange(1, 101)])
+    self.assertEquals(list(intalg.yield_factorize_upto(100, True)),
+                      [(i, intalg.factorize(i)) for i in xrange(1, 101)])
+    self.assertEquals([(1, [])], list(intalg.yield_factorize_upto(1)))
+    self.assertEquals(
+        [(i, tuple(intalg.rle(intalg.factorize(i)))) for i in xrange(1, 501)],
+        sorted(intalg.yield_rle_factorize_upto(500)))
+    self.assertEquals(
+        [(i, tuple(intalg.rle(intalg.factorize(i)))) for i in xrange(1, 501)],
+        list(intalg.yield_rle_factorize_upto(500, True)))
+    self.assertRaises(ValueError, list, intalg.yield_rle_factorize_upto(0))
 
   def testFastExpWithFunc(self):
     f = intalg.fast_exp_with_func
@@ -615,6 +1212,61 @@ class IntalgSmokeTest(unittest.TestCase):
         3115890), (962, 93), (1351, 130), (158070671986249, 15140424455100),
         (21, 2)]
 
+  def testFactorizeFactorial(self):
+    self.assertEquals(intalg.Factorization(3628800),
+                      intalg.factorize_factorial(10))
+    self.assertEquals(intalg.Factorization(1), intalg.factorize_factorial(0))
+
+  def testFactorizeBinomial(self):
+    for n in xrange(30):
+      for k in xrange(n + 1):
+        self.assertEquals(intalg.Factorization(intalg.choose(n, k)),
+                          intalg.factorize_binomial(n, k))
+    self.assertEquals(intalg.choose(1000, 400),
+                      intalg.factorize_binomial(1000, 400).value())
+    self.assertRaises(ValueError, intalg.factorize_binomial, 5, 6)
+    self.assertRaises(ValueError, intalg.factorize_binomial, 5, -1)
+
+  def testFactorizePower(self):
+    p = 1000000007
+    self.assertEquals(((2, 200), (3, 100), (p, 100)),
+                      intalg.factorize_power(12 * p, 100).pairs)
+    self.assertEquals((), intalg.factorize_power(12, 0).pairs)
+    self.assertEquals(((2, 8), (3, 4)),
+                      intalg.factorize_power(intalg.Factorization(12), 4).pairs)
+    self.assertRaises(ValueError, intalg.factorize_power, 12, -1)
+
+  def testFactorizeProduct(self):
+    p = 1000000007
+    self.assertEquals(((2, 4), (3, 1), (5, 1), (p, 3)),
+                      intalg.factorize_product(
+                          [12 * p, p, 20 * p, 1]).pairs)
+    self.assertEquals(((2, 3), (7, 1)), intalg.factorize_product(
+        [intalg.Factorization(4), 14]).pairs)
+    self.assertEquals((), intalg.factorize_product([]).pairs)
+    self.assertRaises(ValueError, intalg.factorize_product, [3, 0])
+
+  def testFactorizeCunningham(self):
+    for a in (2, 3, 4, 10):
+      for n in xrange(1, 21):
+        for sign in (1, -1):
+          self.assertEquals(intalg.factorize(a ** n + sign),
+                            intalg.factorize_cunningham(a, n, sign).primes())
+    self.assertEquals(intalg.factorize(3 ** 20 - 2 ** 20),
+                      intalg.factorize_cunningham(3, 20, -1, 2).primes())
+    self.assertEquals(intalg.factorize(3 ** 21 + 2 ** 21),
+                      intalg.factorize_cunningham(2, 21, 1, 3).primes())
+    # Aurifeuillian factors: Phi_20(2) == 5 * 41, Phi_18(3) == 19 * 37.
+    self.assertEquals([5, 5, 41],
+                      list(intalg._yield_cunningham_pieces(2, 1, 10, 1)))
+    self.assertEquals([4, 7, 19, 37],
+                      list(intalg._yield_cunningham_pieces(3, 1, 9, 1)))
+    self.assertEquals(2 ** 126 + 1, intalg.factorize_cunningham(
+        2, 126, 1).value())
+    self.assertRaises(ValueError, intalg.factorize_cunningham, 2, 5, -1, 3)
+    self.assertRaises(ValueError, intalg.factorize_cunningham, 1, 5, -1)
+    self.assertRaises(ValueError, intalg.factorize_cunningham, 2, 5, 0)
+
   def testYieldRleFactorizeFactorial(self):
     f = intalg.yield_rle_factorize_factorial
     self.assertEquals((), tuple(f(0)))